@@ -0,0 +1,71 @@
+"""
+Shared Surya OCR predictors.
+Each predictor loads large model weights, so it is created once per process and reused.
+"""
+import os
+import threading
+from functools import lru_cache
+
+import torch
+from dotenv import load_dotenv
+from PIL import Image, ImageDraw, ImageFont
+from surya.foundation import FoundationPredictor
+from surya.recognition import RecognitionPredictor
+from surya.detection import DetectionPredictor
+from surya.layout import LayoutPredictor
+from surya.settings import settings
+
+# Load environment variables
+load_dotenv()
+
+# Opt in to Surya's torch.compile'd models: the first calls are slower, steady-state inference is faster
+if os.getenv("OCR_COMPILE", "").lower() in ("1", "true", "yes"):
+    settings.COMPILE_ALL = True
+
+# Let cuDNN benchmark and cache the fastest kernels for the input shapes it sees
+torch.backends.cudnn.benchmark = True
+
+# Optionally cap the CPU threads used for inference (torch defaults to the number of physical cores)
+if os.getenv("TORCH_NUM_THREADS"):
+    torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS")))
+
+# The predictors keep per-call state (e.g. the KV cache) on the shared instances,
+# so calls from different threads must not overlap
+ocr_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_foundation() -> FoundationPredictor:
+    """Get the shared foundation model predictor."""
+    return FoundationPredictor()
+
+
+@lru_cache(maxsize=1)
+def get_recognition() -> RecognitionPredictor:
+    """Get the shared text recognition predictor."""
+    return RecognitionPredictor(get_foundation())
+
+
+@lru_cache(maxsize=1)
+def get_detection() -> DetectionPredictor:
+    """Get the shared text detection predictor."""
+    return DetectionPredictor()
+
+
+@lru_cache(maxsize=1)
+def get_layout() -> LayoutPredictor:
+    """Get the shared layout analysis predictor."""
+    return LayoutPredictor()
+
+
+def warmup() -> None:
+    """
+    Load the OCR predictors and run one small inference, so the first
+    real request doesn't pay for weight loading, kernel selection or,
+    with OCR_COMPILE enabled, model compilation.
+    """
+    # Draw some text so both detection and recognition actually run
+    image = Image.new("RGB", (256, 64), "white")
+    ImageDraw.Draw(image).text((10, 12), "Warm up 123", fill="black", font=ImageFont.load_default(32))
+    with ocr_lock:
+        get_recognition()([image], det_predictor=get_detection())
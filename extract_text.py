@@ -5,74 +5,56 @@ Simple script to extract text from a screenshot using Surya OCR.
 import sys
 import os
 import json
-from PIL import Image
-from surya.foundation import FoundationPredictor
-from surya.recognition import RecognitionPredictor
-from surya.detection import DetectionPredictor
-from surya.layout import LayoutPredictor
 
-def extract_text_from_image(image_path, verbose=True):
+from _predictors import get_recognition, get_detection, get_layout, ocr_lock
+from image_processor import open_image, scale_text_blocks
+
+def extract_text_from_image(image_path, verbose=True, with_layout=False):
     """
     Extract text from an image using Surya OCR.
     
     Args:
         image_path: Path to the image file
         verbose: Whether to print detailed information
+        with_layout: Whether to also run layout analysis (an extra model pass)
         
     Returns:
         Dict containing extracted text and additional information
     """
     try:
         # Open the image
-        image = Image.open(image_path)
+        image, full_size = open_image(image_path)
         
-        # Initialize Surya components
-        foundation_model = FoundationPredictor()
-        text_recognizer = RecognitionPredictor(foundation_model)
-        text_detector = DetectionPredictor()
-        layout_analyzer = LayoutPredictor()
+        # Get the shared Surya components
+        text_recognizer = get_recognition()
+        text_detector = get_detection()
         
         if verbose:
             print(f"Processing image: {image_path}")
         
-        # Detect text regions
-        detection_results = text_detector([image])
-        
-        # Extract text from the entire image
-        recognition_results = text_recognizer([image], det_predictor=text_detector)
-        
-        # Get layout information
-        layout_results = layout_analyzer([image])
+        # Detect and recognize text in a single pass over the full image
+        with ocr_lock:
+            recognition_results = text_recognizer([image], det_predictor=text_detector)
         
-        # Process detection results
+        # Process recognition results
         text_blocks = []
         full_text = []
         
-        if detection_results and len(detection_results) > 0:
-            bboxes = detection_results[0].__dict__.get("bboxes", [])
+        if recognition_results and len(recognition_results) > 0:
+            for line in recognition_results[0].text_lines:
+                if line.text:
+                    text_blocks.append({
+                        "text": line.text,
+                        "box": line.bbox
+                    })
+                    full_text.append(line.text)
             
-            for box in bboxes:
-                # Crop the image to the detected text region
-                x1, y1, x2, y2 = box.bbox
-                text_region = image.crop((x1, y1, x2, y2))
-                
-                # Recognize text in the region
-                region_recognition = text_recognizer([text_region], det_predictor=text_detector)
-                
-                if region_recognition and len(region_recognition) > 0:
-                    text_lines = region_recognition[0].__dict__.get("text_lines", [])
-                    recognized_text = [line.__dict__.get("text", "") for line in text_lines]
-                    recognized_text = " ".join(filter(None, recognized_text))
-                    
-                    if recognized_text:
-                        text_blocks.append({
-                            "text": recognized_text,
-                            "box": [x1, y1, x2, y2]
-                        })
-                        full_text.append(recognized_text)
+            # Boxes are relative to the decoded image, which may be draft-downscaled
+            scale_text_blocks(text_blocks, image.size, full_size)
         
-        # Process layout results
+        # Get layout information only when requested
         layout_info = {}
+        layout_results = get_layout()([image]) if with_layout else None
         if layout_results and len(layout_results) > 0:
             layout_info = layout_results[0].__dict__
             # Convert any non-serializable objects to strings
@@ -91,7 +73,6 @@ def extract_text_from_image(image_path, verbose=True):
         if verbose:
             print("\nExtracted Text:")
             print(extracted_text)
-            print(f"\nDetected Language: {language}")
             print(f"\nFound {len(text_blocks)} text blocks")
         
         return result
@@ -105,7 +86,7 @@ def extract_text_from_image(image_path, verbose=True):
 if __name__ == "__main__":
     # Check if image path is provided as command line argument
     if len(sys.argv) < 2:
-        print("Usage: python extract_text.py <image_path>")
+        print("Usage: python extract_text.py <image_path> [--layout]")
         sys.exit(1)
     
     # Get the image path from command line argument
@@ -117,7 +98,7 @@ if __name__ == "__main__":
         sys.exit(1)
     
     # Extract text from the image
-    result = extract_text_from_image(image_path)
+    result = extract_text_from_image(image_path, with_layout="--layout" in sys.argv[2:])
     
     # Save the result to a JSON file
     output_path = os.path.splitext(image_path)[0] + "_ocr.json"
@@ -3,16 +3,152 @@ Image processor module for handling screenshots and OCR functionality.
 Uses Surya OCR for text extraction from images.
 """
 import os
-import tempfile
+import asyncio
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+from typing import BinaryIO, Dict, List, Optional, Tuple, Any, Union
 
 import numpy as np
-from PIL import Image
-from surya.foundation import FoundationPredictor
-from surya.recognition import RecognitionPredictor
-from surya.detection import DetectionPredictor
-from surya.layout import LayoutPredictor
+from PIL import Image, ImageStat
+
+from _predictors import get_foundation, get_recognition, get_detection, get_layout, ocr_lock
+
+# Optional libjpeg-turbo decoder for JPEG inputs; PIL decodes everything when it is unavailable
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
+
+# Size images are downsampled to before color analysis
+ANALYSIS_SIZE = (128, 128)
+
+# JPEGs whose longest side exceeds this many pixels are downscaled while decoding
+DRAFT_THRESHOLD = 2000
+
+# Smallest size the JPEG decoder may downscale large images to
+DRAFT_SIZE = (2048, 2048)
+
+
+def open_image(source: Any) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Open an image, letting the JPEG decoder downscale very large images while decoding.
+    
+    Args:
+        source: File path, binary file object, raw image bytes or an already opened PIL Image
+        
+    Returns:
+        Tuple of (image, original size); the image may be smaller than the original size
+    """
+    if isinstance(source, Image.Image):
+        return source, source.size
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    
+    # Decode in-memory JPEGs with libjpeg-turbo when it is installed
+    if _turbojpeg is not None and isinstance(source, BytesIO):
+        with source.getbuffer() as data:
+            decoded = _decode_jpeg(data)
+        if decoded is not None:
+            return decoded
+    
+    image = Image.open(source)
+    full_size = image.size
+    
+    # Decoding at reduced scale is much cheaper, and OCR resizes large inputs anyway
+    if image.format == "JPEG" and max(full_size) > DRAFT_THRESHOLD:
+        image.draft("RGB", DRAFT_SIZE)
+    
+    return image, full_size
+
+
+def _decode_jpeg(data: memoryview) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+    """
+    Decode a JPEG with libjpeg-turbo, downscaling very large images while decoding like open_image.
+    
+    Args:
+        data: Raw image data
+        
+    Returns:
+        Tuple of (image, original size), or None if the data is not a JPEG turbojpeg can decode
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    
+    try:
+        width, height, _, _ = _turbojpeg.decode_header(data)
+        
+        # Same reduction PIL's draft() would pick: the largest 1/2, 1/4 or 1/8 scale
+        # that keeps the image at least DRAFT_SIZE
+        scaling_factor = None
+        if max(width, height) > DRAFT_THRESHOLD:
+            reduction = min(width // DRAFT_SIZE[0], height // DRAFT_SIZE[1])
+            for denominator in (8, 4, 2):
+                if reduction >= denominator:
+                    scaling_factor = (1, denominator)
+                    break
+        
+        pixels = _turbojpeg.decode(data, pixel_format=TJPF_RGB, scaling_factor=scaling_factor)
+    except OSError:
+        # Leave unusual JPEGs (e.g. CMYK) to PIL
+        return None
+    
+    return Image.fromarray(pixels), (width, height)
+
+
+def scale_text_blocks(
+    text_blocks: List[Dict[str, Any]],
+    image_size: Tuple[int, int],
+    full_size: Tuple[int, int]
+) -> List[Dict[str, Any]]:
+    """
+    Map text block boxes from the decoded image back to original image coordinates.
+    
+    Args:
+        text_blocks: Text blocks with boxes relative to the decoded image
+        image_size: Size of the decoded image
+        full_size: Original image size
+        
+    Returns:
+        The same text blocks, with boxes in original image coordinates
+    """
+    if image_size == full_size:
+        return text_blocks
+    
+    scale_x = full_size[0] / image_size[0]
+    scale_y = full_size[1] / image_size[1]
+    for block in text_blocks:
+        x1, y1, x2, y2 = block["box"]
+        block["box"] = [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+    
+    return text_blocks
+
+
+def _histogram_topk(pixels: np.ndarray, num_colors: int) -> np.ndarray:
+    """
+    Find the most frequent colors in a list of pixels using a quantized color histogram.
+    
+    Args:
+        pixels: uint8 array of shape (N, C) with C >= 3, RGB in the first three channels
+        num_colors: Number of colors to return
+        
+    Returns:
+        uint8 array of shape (num_colors, 3), most frequent color first
+    """
+    # Quantize each channel to 5 bits and pack RGB into a single 15-bit bin index
+    quantized = (pixels[:, :3] >> 3).astype(np.uint16)
+    bins = (quantized[:, 0] << 10) | (quantized[:, 1] << 5) | quantized[:, 2]
+    counts = np.bincount(bins, minlength=1 << 15)
+    
+    # Select the most frequent bins without sorting the whole histogram
+    num_colors = min(num_colors, int(np.count_nonzero(counts)))
+    top_bins = np.argpartition(-counts, num_colors)[:num_colors]
+    top_bins = top_bins[np.argsort(-counts[top_bins])]
+    
+    # Unpack the bin indices back to RGB values
+    dominant = np.stack([top_bins >> 10, (top_bins >> 5) & 0x1F, top_bins & 0x1F], axis=1) << 3
+    return dominant.astype(np.uint8)
+
 
 class ImageProcessor:
     """
@@ -21,48 +157,101 @@ class ImageProcessor:
     
     def __init__(self):
         """Initialize the image processor with Surya components."""
-        # Initialize Surya components
-        
-        self.foundation_model = FoundationPredictor()
-        self.text_recognizer = RecognitionPredictor(self.foundation_model)
-        self.text_detector = DetectionPredictor()
-        self.layout_analyzer = LayoutPredictor()
+        # Use the shared Surya components (weights are loaded once per process)
+        self.foundation_model = get_foundation()
+        self.text_recognizer = get_recognition()
+        self.text_detector = get_detection()
+        self.layout_analyzer = get_layout()
         
     
-    def process_image(self, image_data: bytes) -> Dict[str, Any]:
+    def process_image(self, image_data: Union[bytes, BinaryIO, Image.Image]) -> Dict[str, Any]:
         """
         Process an image using Surya OCR to extract text and analyze content.
         
         Args:
-            image_data: Raw image data in bytes
+            image_data: Raw image data in bytes, a binary file object, or a PIL Image
             
         Returns:
             Dict containing extracted text and analysis results
         """
-        # Create a temporary file to save the image
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-            temp_file.write(image_data)
-            temp_file_path = temp_file.name
+        # Open the image with PIL directly from memory
+        image, full_size = open_image(image_data)
         
-        try:
-            # Open the image with PIL
-            image = Image.open(temp_file_path)
+        # Extract text using Surya components
+        ocr_result = self._extract_text(image)
+        
+        return self._build_result(image, full_size, ocr_result)
+    
+    def process_image_batch(self, image_data_list: List[Union[bytes, BinaryIO, Image.Image]]) -> List[Dict[str, Any]]:
+        """
+        Process several images with a single batched OCR call.
+        
+        Args:
+            image_data_list: List of images, each in any form accepted by process_image
+            
+        Returns:
+            List of dicts, one per image, in the same format as process_image
             
-            # Extract text using Surya components
-            ocr_result = self._extract_text(image)
+        Raises:
+            Exception: If an image can't be opened or the OCR call fails; unlike
+                process_image, a failed OCR call is not turned into empty text
+        """
+        opened = [open_image(image_data) for image_data in image_data_list]
+        images = [image for image, _ in opened]
+        
+        # Extract text from all images at once
+        ocr_results = self._extract_text_batch(images)
+        
+        return [
+            self._build_result(image, full_size, ocr_result)
+            for (image, full_size), ocr_result in zip(opened, ocr_results)
+        ]
+    
+    def _build_result(self, image: Image.Image, full_size: Tuple[int, int], ocr_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Combine OCR output and image analysis into the process_image result.
+        
+        Args:
+            image: Decoded PIL Image object
+            full_size: Original image size, which differs from image.size for draft-decoded JPEGs
+            ocr_result: Result of _extract_text for the image
             
-            # Analyze the image content
-            image_analysis = self._analyze_image(image)
+        Returns:
+            Dict containing extracted text and analysis results, plus "ocr_failed": True
+            if the OCR call failed and the text is empty because of that
+        """
+        result = {
+            "text": ocr_result.get("text", ""),
+            "text_blocks": scale_text_blocks(ocr_result.get("text_blocks", []), image.size, full_size),
+            "analysis": self._analyze_image(image, full_size)
+        }
+        if ocr_result.get("ocr_failed"):
+            result["ocr_failed"] = True
+        return result
+    
+    async def process_images_async(self, image_list: List[bytes], batch_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Process several images on a worker thread without blocking the event loop.
+        
+        The shared Surya predictors can only run one call at a time, so images are
+        processed in batched OCR calls rather than on parallel threads.
+        
+        Args:
+            image_list: List of raw image data in bytes
+            batch_size: Maximum number of images per OCR call
+                (defaults to the OCR_BATCH_SIZE env var, then 8)
             
-            return {
-                "text": ocr_result.get("text", ""),
-                "text_blocks": ocr_result.get("text_blocks", []),
-                "analysis": image_analysis
-            }
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+        Returns:
+            List of dicts, one per image, in the same format as process_image
+        """
+        if batch_size is None:
+            batch_size = int(os.getenv("OCR_BATCH_SIZE", 8))
+        
+        results = []
+        for start in range(0, len(image_list), batch_size):
+            batch = image_list[start:start + batch_size]
+            results.extend(await asyncio.to_thread(self.process_image_batch, batch))
+        return results
     
     def _extract_text(self, image: Image.Image) -> Dict[str, Any]:
         """
@@ -72,78 +261,83 @@ class ImageProcessor:
             image: PIL Image object
             
         Returns:
-            Dict containing extracted text and related information
+            Dict containing extracted text and related information; empty if OCR fails
         """
         try:
-            # Detect text regions
-            detection_result = self.text_detector([image])[0].__dict__.get("bboxes")
+            return self._extract_text_batch([image])[0]
+        except Exception as e:
+            print(f"Error extracting text: {e}")
+            return {"text": "", "text_blocks": [], "ocr_failed": True}
+    
+    def _extract_text_batch(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """
+        Extract text from several images in one recognizer call.
+        
+        Args:
+            images: List of PIL Image objects
             
-            # Extract text from detected regions
+        Returns:
+            List of dicts containing extracted text and related information
+            
+        Raises:
+            Exception: Recognizer errors are propagated, so callers can retry or fail the batch
+        """
+        # Detect and recognize text for the whole batch in a single pass
+        with ocr_lock:
+            recognition_results = self.text_recognizer(images, det_predictor=self.text_detector)
+        
+        results = []
+        for recognition_result in recognition_results:
             text_blocks = []
             full_text = []
             
-            for box in detection_result:
-                bbox = box.bbox
-                # Crop the image to the detected text region
-                x1, y1, x2, y2 = bbox
-                text_region = image.crop((x1, y1, x2, y2))
-                
-                # Recognize text in the region
-                # recognition_result = self.text_recognizer.predict(text_region)
-                recognition_result = self.text_recognizer([text_region], det_predictor=self.text_detector)[0].__dict__.get("text_lines")
-                recognized_text = [recognition_result[i].__dict__.get("text") for i in range(len(recognition_result))]
-                recognized_text = " ".join(recognized_text)
-                
-                if recognized_text:
+            for line in recognition_result.text_lines:
+                if line.text:
                     text_blocks.append({
-                        "text": recognized_text,
-                        "box": bbox
+                        "text": line.text,
+                        "box": line.bbox
                     })
-                    full_text.append(recognized_text)
+                    full_text.append(line.text)
             
             # Get layout information
             # layout_result = self.layout_analyzer([image])
             
-            return {
+            results.append({
                 "text": " ".join(full_text),
                 "text_blocks": text_blocks,
                 # "layout": layout_result.get("layout", {})
-            }
-        except Exception as e:
-            print(f"Error extracting text: {e}")
-            return {
-                "text": "",
-                "text_blocks": [],
-                # "layout": {}
-            }
+            })
+        
+        return results
     
-    def _analyze_image(self, image: Image.Image) -> Dict[str, Any]:
+    def _analyze_image(self, image: Image.Image, full_size: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
         """
         Analyze image content to extract additional information.
         
         Args:
             image: PIL Image object
+            full_size: Original image size, if the image was decoded at reduced resolution
             
         Returns:
             Dict containing analysis results
         """
         # Get image dimensions
-        width, height = image.size
-        
-        # Convert to numpy array for analysis
-        img_array = np.array(image)
+        width, height = full_size or image.size
         
-        # Simple color analysis
-        if len(img_array.shape) == 3 and img_array.shape[2] >= 3:
-            # Calculate average RGB values
-            avg_color = np.mean(img_array, axis=(0, 1))
+        # Simple color analysis (skipped for single-band images such as grayscale, 16-bit or palette)
+        if len(image.getbands()) >= 3:
+            # Downsample once so color analysis doesn't walk every full-resolution pixel
+            thumbnail = image.resize(ANALYSIS_SIZE, Image.BILINEAR)
+            
+            # Calculate average RGB values (per-band integer sums in C, no float array copy)
+            avg_color = ImageStat.Stat(thumbnail).mean
             
             # Determine if image is bright or dark
-            brightness = np.mean(avg_color[:3])
+            brightness = sum(avg_color[:3]) / 3
             is_bright = brightness > 127
             
             # Detect dominant colors
-            dominant_colors = self._get_dominant_colors(img_array)
+            dominant_colors = self._get_dominant_colors(np.asarray(thumbnail))
         else:
             avg_color = [0, 0, 0]
             is_bright = False
@@ -156,7 +350,7 @@ class ImageProcessor:
                 "aspect_ratio": width / height if height > 0 else 0
             },
             "color_info": {
-                "average_color": avg_color.tolist() if isinstance(avg_color, np.ndarray) else avg_color,
+                "average_color": avg_color,
                 "is_bright": int(is_bright),
                 "dominant_colors": dominant_colors
             }
@@ -173,23 +367,112 @@ class ImageProcessor:
         Returns:
             List of RGB values representing dominant colors
         """
-        # Reshape the array to be a list of pixels
+        # Reshape the array to be a list of pixels (the input is already a small thumbnail)
         pixels = img_array.reshape(-1, img_array.shape[2])
         
-        # Sample pixels to reduce computation (take every 100th pixel)
-        sampled_pixels = pixels[::100]
+        # Return top N colors
+        return _histogram_topk(pixels, num_colors).tolist()
+
+
+class OCRBatcher:
+    """
+    Groups images submitted at about the same time into a single batched OCR call.
+    Requests arriving within a short window share one recognizer pass instead of
+    each running its own.
+    """
+    
+    def __init__(
+        self,
+        processor: ImageProcessor,
+        max_batch_size: Optional[int] = None,
+        window_ms: Optional[float] = None
+    ):
+        """
+        Initialize the batcher.
+        
+        Args:
+            processor: Image processor running the batched OCR calls
+            max_batch_size: Maximum number of images per OCR call
+                (defaults to the OCR_BATCH_SIZE env var, then 8)
+            window_ms: Milliseconds to wait for more images after the first one arrives
+                (defaults to the OCR_BATCH_WINDOW_MS env var, then 15)
+        """
+        self.processor = processor
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv("OCR_BATCH_SIZE", 8))
+        if window_ms is None:
+            window_ms = float(os.getenv("OCR_BATCH_WINDOW_MS", 15))
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, image_data: Union[bytes, BinaryIO, Image.Image]) -> Dict[str, Any]:
+        """
+        Queue an image for the next OCR batch and wait for its result.
         
-        # Simple clustering to find dominant colors
-        # This is a simplified approach; for production, consider using k-means clustering
-        unique_colors, counts = np.unique(sampled_pixels, axis=0, return_counts=True)
+        Args:
+            image_data: Image in any form accepted by ImageProcessor.process_image
+            
+        Returns:
+            Dict in the same format as ImageProcessor.process_image
+        """
+        # Start the worker lazily, on the event loop the requests run on
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
         
-        # Sort by frequency
-        sorted_indices = np.argsort(-counts)
-        dominant = unique_colors[sorted_indices]
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image_data, future))
+        return await future
+    
+    async def _run(self) -> None:
+        """Collect queued images into batches and process them until cancelled."""
+        while True:
+            batch = [await self._queue.get()]
+            
+            # Give concurrent requests a moment to join the batch
+            await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            # Skip requests whose callers have given up in the meantime
+            batch = [(image_data, future) for image_data, future in batch if not future.done()]
+            if not batch:
+                continue
+            
+            try:
+                results = await asyncio.to_thread(
+                    self.processor.process_image_batch, [image_data for image_data, _ in batch]
+                )
+            except Exception:
+                # A single unreadable image fails the whole batch, so retry the images
+                # one by one and only fail the requests that actually error
+                await self._run_individually(batch)
+                continue
+            
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    async def _run_individually(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """
+        Process the images of a failed batch one at a time.
         
-        # Return top N colors
-        return dominant[:num_colors].tolist()
-
+        Args:
+            batch: List of (image data, future) pairs
+        """
+        for image_data, future in batch:
+            if hasattr(image_data, "seek"):
+                image_data.seek(0)
+            try:
+                result = (await asyncio.to_thread(self.processor.process_image_batch, [image_data]))[0]
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
 
 # Example usage
 if __name__ == "__main__":
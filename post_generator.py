@@ -4,7 +4,11 @@ Post generator module for creating trending Xiaohongshu-style posts.
 import os
 import json
 import sys
-from typing import Dict, List, Any, Optional
+import asyncio
+import hashlib
+import threading
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import random
 import logging
@@ -17,10 +21,76 @@ load_dotenv()
 
 # Initialize OpenAI client
 LLM_API_KEY = os.getenv("ZHIPU_API_KEY")
+LLM_MODEL = "glm-4.5"
+
+# Bump whenever a prompt below changes, so cached responses for the old prompts are not reused
+PROMPT_VERSION = "1"
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Emojis used for styles without their own emoji set
+DEFAULT_EMOJIS = ("✨", "💫", "🌈", "💖", "🥰", "🌟", "🌱")
+
+# Content length (in characters) after which title and hashtag generation starts
+# while the rest of the content is still streaming; about 80% of the 500-character target
+EARLY_TITLE_CHARS = 400
+
+# Number of content characters shown to the LLM when generating hashtags on their own
+HASHTAG_CONTENT_CHARS = 300
+
+# Rules for generating a Xiaohongshu title
+TITLE_RULES = """**标题公式**：
+- 采用「人群+痛点/利益点+解决方案」结构
+- 融合数字/悬念词/感叹词（如：程序员必看！3天提效200%的AI工具链💥）
+- 参考句式：
+    * 震惊体："我竟然用XX天实现了XX！"
+    * 数字体："XX个技巧让XX效率翻倍"
+    * 反差体："别再XX了！这个方法YYY更有效"
+"""
+
+# Rules for generating a Xiaohongshu hashtag combination
+HASHTAG_RULES = """# Role: 小红书标签优化专家  
+## 任务  
+基于用户提供的爆款文章正文，生成高转化率的小红书标签组合（Tags），需同时满足**搜索流量提升**和**算法推荐**双目标。  
+
+### 标签生成策略（三层矩阵）  
+1. **流量池钥匙（占30%）**  
+   - 选择2-3个百万级泛流量词，覆盖基础用户池  
+   - 要求：从当前平台热门标签中匹配（参考实时热搜词）  
+   - 示例：`#程序员` `#AI工具` `#效率提升`  
+
+2. **精准狙击器（占50%）**  
+   - 生成3-4个垂直领域标签，锁定细分人群需求  
+   - 要求：结合正文关键词+行业高转化词（如技术类用`#独立开发者`，美妆类用`#黄黑皮天菜`）  
+   - 示例：`#初创公司技术栈` `#全栈开发` `#低成本创业`  
+
+3. **长尾钩子（占20%）**  
+   - 创建1-2个蓝海长尾词，避开头部竞争  
+   - 要求：  
+     ▪️ 包含「解决方案+人群/场景」结构（例：`#学生党平价开发工具`）  
+     ▪️ 搜索量/内容量比值＞5（通过工具检测）  
+
+### 核心规则  
+⚠️ **强制条款**  
+- 标签总数：**严格控制在5-8个**（超出触发限流）  
+- 排序逻辑：按「泛流量→垂类词→长尾词」顺序排列（前3位必须含大热词）  
+- 敏感词规避：用「零克查词」检测，替换灰色词（如`#免费`→`#同价位更狠`）  
+
+🚫 **绝对禁忌**  
+× 禁用重复标签（如同时用`#技术栈`和`#开发工具`）  
+× 禁用失效标签（参考平台每月公示的「过时标签库」）  
+× 禁用纯英文标签（中文标签曝光率高42%）  
+
+### 高阶技巧  
+1. **热点截流**  
+   - 若正文含热点关键词（如`AI`），添加带🔥图标的标签（例：`#AIGC工具🔥`）  
+2. **跨屏引流**  
+   - 同步抖音/微博热搜词（如`#多巴胺编程`），在标签和正文各出现3次  
+3. **养号策略**  
+   - 新账号前5篇笔记固定使用相同核心标签（例：技术类必带`#技术栈`+`#效率翻倍`）
+"""
+
 class PostGenerator:
     """
     Generates trending Xiaohongshu-style posts based on image analysis and extracted text.
@@ -28,7 +98,18 @@ class PostGenerator:
     
     def __init__(self):
         """Initialize the post generator."""
-        self.xiaohongshu_styles = [
+        # Reuse one client (and its HTTP connection pool) for every LLM call
+        self._client = ZhipuAiClient(api_key=LLM_API_KEY)  # 请填写您自己的 API Key
+        
+        # Directory for cached LLM responses; caching is disabled when unset
+        self._cache_dir = os.getenv("LLM_CACHE_DIR")
+        if self._cache_dir:
+            os.makedirs(self._cache_dir, exist_ok=True)
+        
+        # Worker threads for LLM calls that overlap with a streaming response
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        
+        self.xiaohongshu_styles = (
             "lifestyle",
             "fashion",
             "beauty",
@@ -47,60 +128,226 @@ class PostGenerator:
             "plays",
             "films",
             "series"
-        ]
+        )
         
         self.emoji_sets = {
-            "lifestyle": ["✨", "💫", "🌈", "💖", "🥰", "🌟", "🌱"],
-            "fashion": ["👗", "👠", "👜", "💅", "👒", "✨", "💎"],
-            "beauty": ["💄", "💋", "✨", "💆‍♀️", "💅", "🧴", "💫"],
-            "food": ["🍜", "🍣", "🍰", "☕", "🍷", "🥂", "😋"],
-            "travel": ["✈️", "🌍", "🏝️", "🗺️", "🧳", "📸", "🌅"],
-            "fitness": ["💪", "🏃‍♀️", "🧘‍♀️", "🥗", "🥤", "🌱", "✨"],
-            "home decor": ["🏠", "🪴", "🛋️", "✨", "🕯️", "🖼️", "💫"],
-            "snowboarding": ["🏂", "❄️", "🏔️", "🌨️", "🎿", "🥶", "🔥"],
-            "bouldering": ["🧗‍♀️", "🧗‍♂️", "💪", "🪨", "🧠", "🤸‍♀️", "✨"],
-            "archery": ["🏹", "🎯", "🔄", "💯", "🧘‍♀️", "🏆", "✨"],
-            "AI": ["🤖", "💻", "🧠", "✨", "🔮", "📊", "🚀"],
-            "news": ["🌍", "🤝", "📜", "🏛️", "🔄", "📰", "🌐"],
-            "exhibitions": ["🖼️", "🏛️", "🎨", "✨", "📸", "🖌️", "👁️"],
-            "concerts": ["🎵", "🎤", "🎸", "🥁", "🎧", "✨", "🔥"],
-            "plays": ["🎭", "🎬", "👥", "🎪", "🎟️", "✨", "👏"],
-            "films": ["🎬", "🍿", "🎞️", "🎭", "🎥", "🎦", "✨"],
-            "series": ["📺", "🍿", "🎬", "📱", "🎭", "🎞️", "✨"]
+            "lifestyle": ("✨", "💫", "🌈", "💖", "🥰", "🌟", "🌱"),
+            "fashion": ("👗", "👠", "👜", "💅", "👒", "✨", "💎"),
+            "beauty": ("💄", "💋", "✨", "💆‍♀️", "💅", "🧴", "💫"),
+            "food": ("🍜", "🍣", "🍰", "☕", "🍷", "🥂", "😋"),
+            "travel": ("✈️", "🌍", "🏝️", "🗺️", "🧳", "📸", "🌅"),
+            "fitness": ("💪", "🏃‍♀️", "🧘‍♀️", "🥗", "🥤", "🌱", "✨"),
+            "home decor": ("🏠", "🪴", "🛋️", "✨", "🕯️", "🖼️", "💫"),
+            "snowboarding": ("🏂", "❄️", "🏔️", "🌨️", "🎿", "🥶", "🔥"),
+            "bouldering": ("🧗‍♀️", "🧗‍♂️", "💪", "🪨", "🧠", "🤸‍♀️", "✨"),
+            "archery": ("🏹", "🎯", "🔄", "💯", "🧘‍♀️", "🏆", "✨"),
+            "AI": ("🤖", "💻", "🧠", "✨", "🔮", "📊", "🚀"),
+            "news": ("🌍", "🤝", "📜", "🏛️", "🔄", "📰", "🌐"),
+            "exhibitions": ("🖼️", "🏛️", "🎨", "✨", "📸", "🖌️", "👁️"),
+            "concerts": ("🎵", "🎤", "🎸", "🥁", "🎧", "✨", "🔥"),
+            "plays": ("🎭", "🎬", "👥", "🎪", "🎟️", "✨", "👏"),
+            "films": ("🎬", "🍿", "🎞️", "🎭", "🎥", "🎦", "✨"),
+            "series": ("📺", "🍿", "🎬", "📱", "🎭", "🎞️", "✨")
         }
+        
+        # Prompts are built once here. Static instructions go in the system message and only
+        # per-call values (filled in with str.format) go in the user message, so every request
+        # starts with a byte-identical prefix that the provider's prompt cache can reuse
+        self._STYLE_SYSTEM_PROMPT = f"""You determine the most appropriate style category for a Xiaohongshu post.
+The user provides text extracted from an image and an optional user query.
+
+Please analyze this content and determine which of the following Xiaohongshu post styles would be most appropriate:
+{", ".join(self.xiaohongshu_styles)}
+
+Return only the style name, nothing else.
+"""
+        self._STYLE_PROMPT_TEMPLATE = """Extracted text from image: {text}
+
+User query: {user_query}
+"""
+        self._ROLE_PROMPT = """# 角色设定  
+你是一名小红书爆款内容创作专家，擅长将普通话题转化为具有病毒式传播力的完整文章。你的核心能力包括：  
+1. 情绪钩子设计：运用“夸张情绪词+反常识观点”引爆好奇心（如“太可怕了”“谁懂啊”“绝绝子”）  
+2. 二极管结构法：通过“痛点刺激-解决方案-逆天效果”三段式框架制造爽感  
+3. 平台化表达：口语化行文+高频emoji+20字内短段落适配移动端阅读  
+
+# 爆款文章生成公式  
+▶ 标题公式（保留原规则升级版）  
+`[情绪词] + [反常识结果] + [人群标签] + [emoji]`  
+✅ 示例：  
+> “太可怕了！用ChatGPT写文案月入5w+，打工人逆袭指南💥”  
 
-    def _call_llm(self, prompt: str, system_prompt: str = "You are a helpful assistant.", max_tokens: int = 4096) -> str:
+▶ 正文结构公式  
+1. 段落小标题（简洁明了）
+2. 情绪冲击开头（引发共鸣）  
+   - 痛点场景故事（50字内）+ 夸张情绪词  
+   > *例：“谁懂啊！熬夜写的文案0点赞，同事用AI 3秒收割10w流量！！”*
+3. 颠覆认知转折（制造反差）  
+   - “直到我发现...” + 反常识方法（突出简单/速成）  
+4. 干货步骤拆解（实用价值）  
+   - 分步骤+emoji图标 + 具体案例（如“实测7天涨粉5千”）  
+5. 高潮金句点题（刺激传播）  
+   - 用“记住：...”句式+争议性观点（例：“不会用AI的文案人，终将被淘汰！”）  
+6. 互动钩子结尾（引导行动）  
+   - “评论区扣【666】领指令库” / “戳合集看100个变现案例”  
+
+# 创作规则  
+1. 内容长度：正文300-500字，分3-5段，并配上段落小标题，每段≤3行  
+2. 关键词植入：从用户提供的关键词库选3个自然融入（如“吐血整理”“手残党必备”）  
+3. 平台特性：  
+   - 每段尽量有段落小标题，并在段落标题和正文中插入1-2个🔥⭐💡类高亮emoji
+   - 关键信息用“！”标点强化情绪
+4. 禁忌：
+   × 避免长段落（每段≤3行）  
+   × 禁止直接出现"小红书"、"粉丝"等平台词  
+   × 禁用复杂标签（后续单独处理） 
+            """
+        self._CONTENT_SYSTEM_PROMPT = self._ROLE_PROMPT + """
+请你根据用户提供的文本内容、风格、和用户对话内容，生成一个小红书爆款文章风格的推文。
+
+请注意：善用情绪钩子、平台化表达。多分段落，并添加emoji。请你直接返回你生成的推文，不要添加任何其他内容。
+"""
+        self._TITLE_SYSTEM_PROMPT = TITLE_RULES + """
+请你根据用户提供的文本内容、风格、和用户对话内容，生成一个符合小红书风格的标题。
+
+请直接返回你生成的标题，不要添加任何其他内容。
+"""
+        self._HASHTAG_SYSTEM_PROMPT = HASHTAG_RULES + """
+### 输出格式
+- 请直接返回你生成的标签，多个标签之间用英文逗号分隔，不要添加任何其他内容。
+
+接下来，请你使用用户提供的文本内容、风格、和用户对话内容，生成一个符合小红书风格的标签组合。
+"""
+        self._TITLE_AND_HASHTAGS_SYSTEM_PROMPT = """请你根据用户提供的文本内容、风格、和用户对话内容，同时生成一个符合小红书风格的标题和标签组合。
+
+## 标题要求
+""" + TITLE_RULES + """
+## 标签要求
+""" + HASHTAG_RULES + """
+### 输出格式
+- 请只返回一个JSON对象，格式为：{"title": "标题", "hashtags": ["标签1", "标签2"]}，不要添加任何其他内容。
+"""
+        # Per-call input shared by the title, hashtag and combined prompts
+        self._POST_INPUT_TEMPLATE = """文本内容：{content}
+
+风格：{style}
+
+用户对话内容：{user_query}
+"""
+
+    def _call_llm(
+        self,
+        prompt: str,
+        system_prompt: str = "You are a helpful assistant.",
+        max_tokens: int = 4096,
+        response_format: Optional[Dict[str, str]] = None,
+        stream: bool = False,
+        stream_cb: Optional[Callable[[str], None]] = None,
+        bypass_cache: bool = False
+    ) -> str:
         """
         Call the LLM to generate text.
         
         Args:
             prompt: The prompt to send to the LLM
+            system_prompt: System message; keep it identical across calls so the provider can cache it
             max_tokens: Maximum tokens to generate
+            response_format: Optional response format, e.g. {"type": "json_object"}
+            stream: Whether to stream the response
+            stream_cb: Called with the text received so far after each streamed chunk
+            bypass_cache: Skip the response cache (see LLM_CACHE_DIR) and always call the LLM
             
         Returns:
             Generated text
         """
-
-        client = ZhipuAiClient(api_key=LLM_API_KEY)  # 请填写您自己的 API Key
+        # Serve identical requests from the response cache when it is enabled
+        cache_path = None
+        if self._cache_dir and not bypass_cache:
+            cache_key = json.dumps(
+                [PROMPT_VERSION, LLM_MODEL, system_prompt, prompt, max_tokens, response_format], ensure_ascii=False
+            )
+            cache_path = os.path.join(self._cache_dir, hashlib.sha256(cache_key.encode("utf-8")).hexdigest() + ".json")
+            cached = self._read_cache(cache_path)
+            if cached is not None:
+                if stream_cb is not None:
+                    stream_cb(cached)
+                return cached
 
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ]
-        print(messages)
 
-        response = client.chat.completions.create(
-            model="glm-4.5",
+        # Only send response_format when requested, so plain-text calls stay unchanged
+        extra_params = {}
+        if response_format is not None:
+            extra_params["response_format"] = response_format
+
+        response = self._client.chat.completions.create(
+            model=LLM_MODEL,
             messages=messages,
             thinking={
                 "type": "enabled",    # 启用深度思考模式
             },
             max_tokens=max_tokens,          # 最大输出tokens
-            temperature=0.7           # 控制输出的随机性
+            temperature=0.7,          # 控制输出的随机性
+            stream=stream,
+            **extra_params
         )
-        print(response.choices[0].message.content)
-        return response.choices[0].message.content
         
+        if not stream:
+            text = response.choices[0].message.content
+        else:
+            # Accumulate the streamed answer (reasoning chunks carry no content)
+            text = ""
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content
+                if piece:
+                    text += piece
+                    if stream_cb is not None:
+                        stream_cb(text)
+        
+        if cache_path and text:
+            self._write_cache(cache_path, text)
+        return text
+    
+    @staticmethod
+    def _read_cache(cache_path: str) -> Optional[str]:
+        """
+        Read a cached LLM response.
+        
+        Args:
+            cache_path: Path of the cache file
+            
+        Returns:
+            Cached text, or None on a cache miss
+        """
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    @staticmethod
+    def _write_cache(cache_path: str, text: str) -> None:
+        """
+        Write an LLM response to the cache.
+        
+        Args:
+            cache_path: Path of the cache file
+            text: Generated text
+        """
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text}, f, ensure_ascii=False)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Error writing LLM cache: {str(e)}")
+    
     
     def generate_post(self, image_data: Dict[str, Any], user_query: str = "") -> Dict[str, Any]:
         """
@@ -111,33 +358,94 @@ class PostGenerator:
             user_query: Optional user query to guide post generation
             
         Returns:
-            Generated post data
+            Generated post data; "fallback" is True if any part of the post is template
+            output used in place of a failed LLM call
         """
+        # Names of the steps that fell back to template output
+        fallbacks = []
+        
         # Extract relevant information from image data
         extracted_text = image_data.get("text", "")
         text_blocks = image_data.get("text_blocks", [])
         image_analysis = image_data.get("analysis", {})
         
         # Determine the most appropriate style based on image content and user query
-        style = self._determine_style(extracted_text, user_query)
-        
-        # Generate the post content
-        content = self._generate_content(extracted_text, text_blocks, image_analysis, style, user_query)
+        style = self._determine_style(extracted_text, user_query, fallbacks=fallbacks)
+        
+        # Stream the post content, and start generating the title and hashtags
+        # on a worker thread once most of the content has arrived
+        early = {}
+        
+        def on_content(content_so_far: str) -> None:
+            if "future" not in early and len(content_so_far) >= EARLY_TITLE_CHARS:
+                early["content"] = content_so_far
+                early["fallbacks"] = []
+                early["future"] = self._executor.submit(
+                    self._generate_title_and_hashtags, content_so_far, style, user_query, early["fallbacks"]
+                )
+        
+        content = self._generate_content(
+            extracted_text, text_blocks, image_analysis, style, user_query,
+            stream_cb=on_content, fallbacks=fallbacks
+        )
         
-        # Generate title based on content
-        title = self.generate_title(content, style, user_query)
+        # Generate title and hashtags based on content in a single LLM call,
+        # unless the early call already started on a prefix of this content
+        future = early.get("future")
+        if future is not None and not content.startswith(early["content"]):
+            future.cancel()
+            future = None
+        elif future is not None and future.cancel():
+            # Still queued behind other posts' calls on the shared executor; running
+            # the call inline is faster than waiting for a worker
+            future = None
+        
+        if future is not None:
+            title, hashtags = future.result()
+            fallbacks.extend(early["fallbacks"])
+        else:
+            title, hashtags = self._generate_title_and_hashtags(content, style, user_query, fallbacks)
         
-        # Generate hashtags
-        hashtags = self._generate_hashtags(content, style, user_query)
+        if fallbacks:
+            logger.warning(f"Post generated with template fallbacks for: {', '.join(fallbacks)}")
         
         return {
             "title": title,
             "content": content,
             "hashtags": hashtags,
-            "style": style
+            "style": style,
+            "fallback": bool(fallbacks)
         }
     
-    def _determine_style(self, text: str, user_query: str = "") -> str:
+    async def generate_posts_batch(
+        self,
+        items: List[Dict[str, Any]],
+        user_query: str = "",
+        concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate posts for several images concurrently on worker threads.
+        
+        Args:
+            items: List of image analysis data, one per post
+            user_query: Optional user query to guide generation of every post
+            concurrency: Maximum number of posts generated at once
+                (defaults to the LLM_CONCURRENCY env var, then 8)
+            
+        Returns:
+            List of generated post data, in the same order as items
+        """
+        if concurrency is None:
+            concurrency = int(os.getenv("LLM_CONCURRENCY", 8))
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_one(image_data: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await asyncio.to_thread(self.generate_post, image_data, user_query)
+        
+        return await asyncio.gather(*(run_one(image_data) for image_data in items))
+    
+    def _determine_style(self, text: str, user_query: str = "", fallbacks: Optional[List[str]] = None) -> str:
         """
         Determine the most appropriate Xiaohongshu style based on image content using LLM.
         
@@ -145,25 +453,17 @@ class PostGenerator:
             text: Extracted text from the image
             image_analysis: Image analysis data
             user_query: Optional user query to guide style determination
+            fallbacks: Optional list that "style" is appended to if the LLM call fails
             
         Returns:
             Style category string
         """
         # Use LLM to determine the style based on the extracted text and image analysis
-        prompt = f"""Based on the following information, determine the most appropriate style category for a Xiaohongshu post:
-Extracted text from image: {text}
-
-User query: {user_query}
-
-Please analyze this content and determine which of the following Xiaohongshu post styles would be most appropriate:
-{', '.join(self.xiaohongshu_styles)}
-
-Return only the style name, nothing else.
-"""
+        prompt = self._STYLE_PROMPT_TEMPLATE.format(text=text, user_query=user_query)
         
         try:
             # Call LLM to determine style
-            response = self._call_llm(prompt)
+            response = self._call_llm(prompt, system_prompt=self._STYLE_SYSTEM_PROMPT)
             
             # Clean and validate the response
             suggested_style = response.strip().lower()
@@ -184,9 +484,80 @@ Return only the style name, nothing else.
         except Exception as e:
             logger.error(f"Error determining style with LLM: {str(e)}")
             # Fall back to random style if LLM fails
+            if fallbacks is not None:
+                fallbacks.append("style")
             return "lifestyle"
 
-    def _generate_hashtags(self, content: str, style: str, user_query: str = "") -> List[str]:
+    def _generate_title_and_hashtags(
+        self,
+        content: str,
+        style: str,
+        user_query: str = "",
+        fallbacks: Optional[List[str]] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Generate the title and hashtags for the post with one JSON-mode LLM call.
+        Falls back to separate title and hashtag calls if the response can't be parsed.
+        
+        Args:
+            content: Generated post content
+            style: Post style
+            user_query: Optional user query to guide generation
+            fallbacks: Optional list that failed steps are appended to (see generate_title and _generate_hashtags)
+            
+        Returns:
+            Tuple of (title, hashtags)
+        """
+        prompt = self._POST_INPUT_TEMPLATE.format(content=content, style=style, user_query=user_query)
+        
+        try:
+            # Call LLM to generate title and hashtags together
+            response = self._call_llm(
+                prompt, system_prompt=self._TITLE_AND_HASHTAGS_SYSTEM_PROMPT, response_format={"type": "json_object"}
+            )
+            
+            # Parse the JSON object, tolerating surrounding text such as code fences
+            start, end = response.find("{"), response.rfind("}")
+            result = json.loads(response[start:end + 1])
+            
+            title = result["title"].strip()
+            hashtags = result["hashtags"]
+            if isinstance(hashtags, str):
+                hashtags = hashtags.split(',')
+            hashtags = self._clean_hashtags(hashtags)
+            if not title or not hashtags:
+                raise ValueError("empty title or hashtags")
+            
+            return title, hashtags
+            
+        except Exception as e:
+            logger.warning(f"Error generating title and hashtags in one call, generating separately: {str(e)}")
+            return (
+                self.generate_title(content, style, user_query, fallbacks=fallbacks),
+                self._generate_hashtags(content, style, user_query, fallbacks=fallbacks)
+            )
+    
+    @staticmethod
+    def _clean_hashtags(hashtags: List[str]) -> List[str]:
+        """
+        Strip hashtags, drop empty ones and limit to 8 max.
+        
+        Args:
+            hashtags: Raw hashtags from the LLM
+            
+        Returns:
+            List of hashtags
+        """
+        hashtags = [str(tag).strip() for tag in hashtags]
+        return [tag for tag in hashtags if tag][:8]
+    
+    def _generate_hashtags(
+        self,
+        content: str,
+        style: str,
+        user_query: str = "",
+        fallbacks: Optional[List[str]] = None
+    ) -> List[str]:
         """
         Generate hashtags for the post using LLM.
         
@@ -194,6 +565,7 @@ Return only the style name, nothing else.
             content: Generated post content
             style: Post style
             user_query: Optional user query to guide hashtag generation
+            fallbacks: Optional list that "hashtags" is appended to if the LLM call fails
             
         Returns:
             List of hashtags
@@ -211,76 +583,30 @@ Return only the style name, nothing else.
         # Return only the hashtags as a comma-separated list, without the # symbol.
         # """
 
-        prompt = f"""# Role: 小红书标签优化专家  
-## 任务  
-基于用户提供的爆款文章正文，生成高转化率的小红书标签组合（Tags），需同时满足**搜索流量提升**和**算法推荐**双目标。  
-
-### 标签生成策略（三层矩阵）  
-1. **流量池钥匙（占30%）**  
-   - 选择2-3个百万级泛流量词，覆盖基础用户池  
-   - 要求：从当前平台热门标签中匹配（参考实时热搜词）  
-   - 示例：`#程序员` `#AI工具` `#效率提升`  
-
-2. **精准狙击器（占50%）**  
-   - 生成3-4个垂直领域标签，锁定细分人群需求  
-   - 要求：结合正文关键词+行业高转化词（如技术类用`#独立开发者`，美妆类用`#黄黑皮天菜`）  
-   - 示例：`#初创公司技术栈` `#全栈开发` `#低成本创业`  
-
-3. **长尾钩子（占20%）**  
-   - 创建1-2个蓝海长尾词，避开头部竞争  
-   - 要求：  
-     ▪️ 包含「解决方案+人群/场景」结构（例：`#学生党平价开发工具`）  
-     ▪️ 搜索量/内容量比值＞5（通过工具检测）  
-
-### 核心规则  
-⚠️ **强制条款**  
-- 标签总数：**严格控制在5-8个**（超出触发限流）  
-- 排序逻辑：按「泛流量→垂类词→长尾词」顺序排列（前3位必须含大热词）  
-- 敏感词规避：用「零克查词」检测，替换灰色词（如`#免费`→`#同价位更狠`）  
-
-🚫 **绝对禁忌**  
-× 禁用重复标签（如同时用`#技术栈`和`#开发工具`）  
-× 禁用失效标签（参考平台每月公示的「过时标签库」）  
-× 禁用纯英文标签（中文标签曝光率高42%）  
-
-### 高阶技巧  
-1. **热点截流**  
-   - 若正文含热点关键词（如`AI`），添加带🔥图标的标签（例：`#AIGC工具🔥`）  
-2. **跨屏引流**  
-   - 同步抖音/微博热搜词（如`#多巴胺编程`），在标签和正文各出现3次  
-3. **养号策略**  
-   - 新账号前5篇笔记固定使用相同核心标签（例：技术类必带`#技术栈`+`#效率翻倍`）  
-
-### 输出格式
-- 请直接返回你生成的标签，多个标签之间用英文逗号分隔，不要添加任何其他内容。
-
-接下来，请你使用以下文本内容、风格、和用户对话内容，生成一个符合小红书风格的标签组合：
-
-文本内容：{content[:300]}
-
-风格：{style}
-
-用户对话内容：{user_query}
-        """
+        content_snippet = content[:HASHTAG_CONTENT_CHARS]  # Truncate to avoid token limits
+        prompt = self._POST_INPUT_TEMPLATE.format(content=content_snippet, style=style, user_query=user_query)
         
         try:
             # Call LLM to generate hashtags
-            response = self._call_llm(prompt)
+            response = self._call_llm(prompt, system_prompt=self._HASHTAG_SYSTEM_PROMPT)
             
             # Process the response
-            hashtags = [tag.strip() for tag in response.split(',')]
-            
-            # Filter out empty tags and limit to 8 max
-            hashtags = [tag for tag in hashtags if tag][:8]
-            
-            return hashtags
+            return self._clean_hashtags(response.split(','))
             
         except Exception as e:
             logger.error(f"Error generating hashtags with LLM: {str(e)}")
             # Return some generic hashtags if LLM fails
+            if fallbacks is not None:
+                fallbacks.append("hashtags")
             return ["小红书", "分享", "推荐", style]
     
-    def generate_title(self, content: str, style: str, user_query: str = "") -> str:
+    def generate_title(
+        self,
+        content: str,
+        style: str,
+        user_query: str = "",
+        fallbacks: Optional[List[str]] = None
+    ) -> str:
         """
         Generate a catchy title for the post using LLM.
         
@@ -288,6 +614,7 @@ Return only the style name, nothing else.
             content: Post content
             style: Post style
             user_query: Optional user query to guide title generation
+            fallbacks: Optional list that "title" is appended to if the LLM call fails
             
         Returns:
             Generated title
@@ -305,28 +632,11 @@ Return only the style name, nothing else.
         # Return only the title, nothing else.
         # """
 
-        prompt = f"""**标题公式**：
-- 采用「人群+痛点/利益点+解决方案」结构
-- 融合数字/悬念词/感叹词（如：程序员必看！3天提效200%的AI工具链💥）
-- 参考句式：
-    * 震惊体："我竟然用XX天实现了XX！"
-    * 数字体："XX个技巧让XX效率翻倍"
-    * 反差体："别再XX了！这个方法YYY更有效"
-
-请你根据以下文本内容、风格、和用户对话内容，生成一个符合小红书风格的标题：
-
-文本内容：{content}
-
-风格：{style}
-
-用户对话内容：{user_query}
-
-请直接返回你生成的标题，不要添加任何其他内容。
-        """
+        prompt = self._POST_INPUT_TEMPLATE.format(content=content, style=style, user_query=user_query)
         
         try:
             # Call LLM to generate title
-            response = self._call_llm(prompt)
+            response = self._call_llm(prompt, system_prompt=self._TITLE_SYSTEM_PROMPT)
             
             # Clean the response
             title = response.strip()
@@ -340,6 +650,8 @@ Return only the style name, nothing else.
         except Exception as e:
             logger.error(f"Error generating title with LLM: {str(e)}")
             # Generate a simple title if LLM fails
+            if fallbacks is not None:
+                fallbacks.append("title")
             return f"我的{style}分享"  # "My {style} sharing"
     
     
@@ -349,7 +661,9 @@ Return only the style name, nothing else.
         text_blocks: List[Dict[str, Any]],
         image_analysis: Dict[str, Any],
         post_style: str,
-        user_query: str = ""
+        user_query: str = "",
+        stream_cb: Optional[Callable[[str], None]] = None,
+        fallbacks: Optional[List[str]] = None
     ) -> str:
         """
         Generate post content using LLM.
@@ -359,6 +673,8 @@ Return only the style name, nothing else.
             text_blocks: Structured text blocks from OCR
             image_analysis: Image analysis data
             post_style: Determined post style
+            stream_cb: Optional callback receiving the content streamed so far
+            fallbacks: Optional list that "content" is appended to if the LLM call fails
             
         Returns:
             Generated post content
@@ -366,46 +682,10 @@ Return only the style name, nothing else.
         try:
             # Prepare the prompt
             prompt = self._create_prompt(extracted_text, text_blocks, image_analysis, post_style, user_query)
-            
-            role_prompt = """# 角色设定  
-你是一名小红书爆款内容创作专家，擅长将普通话题转化为具有病毒式传播力的完整文章。你的核心能力包括：  
-1. 情绪钩子设计：运用“夸张情绪词+反常识观点”引爆好奇心（如“太可怕了”“谁懂啊”“绝绝子”）  
-2. 二极管结构法：通过“痛点刺激-解决方案-逆天效果”三段式框架制造爽感  
-3. 平台化表达：口语化行文+高频emoji+20字内短段落适配移动端阅读  
 
-# 爆款文章生成公式  
-▶ 标题公式（保留原规则升级版）  
-`[情绪词] + [反常识结果] + [人群标签] + [emoji]`  
-✅ 示例：  
-> “太可怕了！用ChatGPT写文案月入5w+，打工人逆袭指南💥”  
-
-▶ 正文结构公式  
-1. 段落小标题（简洁明了）
-2. 情绪冲击开头（引发共鸣）  
-   - 痛点场景故事（50字内）+ 夸张情绪词  
-   > *例：“谁懂啊！熬夜写的文案0点赞，同事用AI 3秒收割10w流量！！”*
-3. 颠覆认知转折（制造反差）  
-   - “直到我发现...” + 反常识方法（突出简单/速成）  
-4. 干货步骤拆解（实用价值）  
-   - 分步骤+emoji图标 + 具体案例（如“实测7天涨粉5千”）  
-5. 高潮金句点题（刺激传播）  
-   - 用“记住：...”句式+争议性观点（例：“不会用AI的文案人，终将被淘汰！”）  
-6. 互动钩子结尾（引导行动）  
-   - “评论区扣【666】领指令库” / “戳合集看100个变现案例”  
-
-# 创作规则  
-1. 内容长度：正文300-500字，分3-5段，并配上段落小标题，每段≤3行  
-2. 关键词植入：从用户提供的关键词库选3个自然融入（如“吐血整理”“手残党必备”）  
-3. 平台特性：  
-   - 每段尽量有段落小标题，并在段落标题和正文中插入1-2个🔥⭐💡类高亮emoji
-   - 关键信息用“！”标点强化情绪
-4. 禁忌：
-   × 避免长段落（每段≤3行）  
-   × 禁止直接出现"小红书"、"粉丝"等平台词  
-   × 禁用复杂标签（后续单独处理） 
-            """
-
-            response = self._call_llm(prompt, system_prompt=role_prompt, max_tokens=8192)
+            response = self._call_llm(
+                prompt, system_prompt=self._CONTENT_SYSTEM_PROMPT, max_tokens=8192, stream=True, stream_cb=stream_cb
+            )
             # print(response)
 
             return response
@@ -413,6 +693,8 @@ Return only the style name, nothing else.
         except Exception as e:
             # Fallback content in case of API error
             print(f"Error generating content: {e}")
+            if fallbacks is not None:
+                fallbacks.append("content")
             return self._generate_fallback_content(extracted_text, post_style)
     
     def _create_prompt(
@@ -444,16 +726,7 @@ Return only the style name, nothing else.
         # - Brightness: {'Bright' if color_info.get('is_bright', False) else 'Dark'}
         
         
-        prompt = f"""请你根据以下文本内容、风格、和用户对话内容，生成一个小红书爆款文章风格的推文：
-
-文本内容：{extracted_text}
-
-风格：{post_style}
-
-用户对话内容：{user_query}
-
-请注意：善用情绪钩子、平台化表达。多分段落，并添加emoji。请你直接返回你生成的推文，不要添加任何其他内容。
-        """
+        prompt = self._POST_INPUT_TEMPLATE.format(content=extracted_text, style=post_style, user_query=user_query)
         
         return prompt
     
@@ -491,7 +764,7 @@ Return only the style name, nothing else.
         Returns:
             List of emoji strings
         """
-        style_emojis = self.emoji_sets.get(post_style, ["✨", "💫", "🌈", "💖", "🥰", "🌟", "🌱"])
+        style_emojis = self.emoji_sets.get(post_style, DEFAULT_EMOJIS)
         
         # Select random emojis from the style category
         if style_emojis:
@@ -8,8 +8,15 @@ This script provides an MCP server for generating trending Xiaohongshu posts fro
 import os
 import sys
 import base64
+import asyncio
+import hashlib
+import queue
+import atexit
 import logging
-import requests
+from logging.handlers import QueueHandler, QueueListener
+import httpx
+import orjson
+from cachetools import TTLCache
 from typing import Dict, Any, List
 from io import BytesIO
 from PIL import Image
@@ -18,27 +25,247 @@ from fastmcp import FastMCP
 from pydantic import BaseModel, Field
 
 # Import local modules
-from image_processor import ImageProcessor
+from _predictors import warmup
+from cache import LRUCache
+from image_processor import ImageProcessor, OCRBatcher
 from post_generator import PostGenerator
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Configure logging. Records are written to stdout by a background thread fed
+# through a queue, so logging never blocks request handling on I/O.
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(QueueHandler(log_queue))
 logger = logging.getLogger("trendy_post_mcp")
 
+class TrendyPostError(Exception):
+    """Base class for errors raised by the MCP tools."""
+    
+    # Context shown before the error message; only formatted when the error is displayed
+    prefix = "Error"
+    
+    def __str__(self) -> str:
+        return f"{self.prefix}: {super().__str__()}"
+
+class DownloadError(TrendyPostError):
+    """Raised when an image can't be downloaded."""
+    prefix = "Error downloading image"
+
+class OCRError(TrendyPostError):
+    """Raised when a downloaded screenshot can't be processed."""
+    prefix = "Error processing screenshot"
+
+class PostGenerationError(TrendyPostError):
+    """Raised when a post can't be generated."""
+    prefix = "Error generating post"
+
+class ProcessAndGenerateError(TrendyPostError):
+    """Raised when process_and_generate fails for a reason other than the download."""
+    prefix = "Error processing and generating"
+
+def _serialize_result(data: Any) -> str:
+    """
+    Serialize a tool result to JSON text with orjson, which is much faster than the
+    default pydantic serializer on large results such as long text_blocks lists.
+    
+    Args:
+        data: Tool result
+        
+    Returns:
+        JSON string
+    """
+    return orjson.dumps(
+        data, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2
+    ).decode()
+
 # Initialize MCP
-mcp = FastMCP("trendy-post-mcp")
+mcp = FastMCP("trendy-post-mcp", tool_serializer=_serialize_result)
 
 # Initialize components
 image_processor = ImageProcessor()
 post_generator = PostGenerator()
 
+# Concurrent screenshots are OCR'd together in one batched recognizer call
+ocr_batcher = OCRBatcher(image_processor)
+
+# Shared async HTTP client, so image downloads reuse pooled keep-alive connections
+# without blocking the event loop. HTTP/2 multiplexes concurrent downloads from the
+# same CDN over one connection. Pool limits are set on the transport, since the
+# client ignores its own limits when given a custom transport.
+http_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+        retries=2
+    ),
+    timeout=30,
+    follow_redirects=True,
+    headers={"User-Agent": "trendy-post-mcp/1.0"}
+)
+
+# Largest image download accepted, in bytes
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+
+# Recent download failures keyed by a hash of the URL, so clients retrying a broken
+# URL fail immediately instead of waiting on the network again
+download_failures = TTLCache(maxsize=1024, ttl=int(os.getenv("DOWNLOAD_FAILURE_TTL", 60)))
+
+async def _download_image(image_url: str) -> BytesIO:
+    """
+    Stream an image download into memory, rejecting images larger than MAX_IMAGE_BYTES.
+    
+    Args:
+        image_url: URL to the image
+        
+    Returns:
+        Buffer holding the image data, positioned at the start
+    """
+    url_key = hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+    error = download_failures.get(url_key)
+    if error is not None:
+        raise error.with_traceback(None)
+    
+    logger.debug("Downloading image from URL: %s", image_url)
+    try:
+        async with http_client.stream("GET", image_url) as response:
+            response.raise_for_status()  # Raise exception for HTTP errors
+            
+            # Reject oversized images before reading the body when the server announces the size
+            if int(response.headers.get("content-length", 0)) > MAX_IMAGE_BYTES:
+                raise DownloadError(f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+            
+            image_data = BytesIO()
+            async for chunk in response.aiter_bytes():
+                image_data.write(chunk)
+                if image_data.tell() > MAX_IMAGE_BYTES:
+                    raise DownloadError(f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+    except DownloadError as e:
+        download_failures[url_key] = e
+        raise
+    except httpx.HTTPError as e:
+        error = DownloadError(str(e))
+        download_failures[url_key] = error
+        raise error from e
+    
+    image_data.seek(0)
+    return image_data
+
+# Cache of OCR results keyed by a hash of the image bytes
+ocr_cache = LRUCache(int(os.getenv("OCR_CACHE_SIZE", 512)))
+
+# Bump when the format of process_image results changes, so stale cache entries are never served
+OCR_CACHE_VERSION = "1"
+
+async def _process_image_cached(image_data: BytesIO) -> Dict[str, Any]:
+    """
+    Process an image, reusing the previous result for identical image bytes.
+    
+    Args:
+        image_data: Buffer holding the raw image data
+        
+    Returns:
+        Image analysis from image_processor.process_image
+    """
+    # Hash the buffer in place rather than copying it out with getvalue()
+    with image_data.getbuffer() as view:
+        digest = hashlib.blake2b(view, digest_size=16).hexdigest()
+    cache_key = f"{OCR_CACHE_VERSION}:{digest}"
+    image_analysis = ocr_cache.get(cache_key)
+    if image_analysis is None:
+        image_analysis = await ocr_batcher.submit(image_data)
+        # A failed OCR pass must not be served as "no text" for this image from now on
+        if not image_analysis.get("ocr_failed"):
+            ocr_cache.put(cache_key, image_analysis)
+    return image_analysis
+
+# Download-and-OCR tasks in progress, keyed by image URL. Only the event loop
+# thread touches this, so no lock is needed.
+_inflight: Dict[str, asyncio.Task] = {}
+
+async def _fetch_and_process(image_url: str) -> Dict[str, Any]:
+    """
+    Download an image and process it.
+    
+    Args:
+        image_url: URL to the image
+        
+    Returns:
+        Image analysis from image_processor.process_image
+    """
+    image_data = await _download_image(image_url)
+    return await _process_image_cached(image_data)
+
+async def _analyze_image_url(image_url: str) -> Dict[str, Any]:
+    """
+    Download and process an image, sharing one download and OCR run between
+    concurrent requests for the same URL.
+    
+    Args:
+        image_url: URL to the image
+        
+    Returns:
+        Image analysis from image_processor.process_image
+    """
+    task = _inflight.get(image_url)
+    if task is None:
+        task = asyncio.create_task(_fetch_and_process(image_url))
+        _inflight[image_url] = task
+        task.add_done_callback(lambda _: _inflight.pop(image_url, None))
+    
+    # Shield the shared task so one cancelled caller doesn't cancel it for the others
+    return await asyncio.shield(task)
+
+# Cache of generated posts keyed by a hash of the extracted text (ignoring whitespace) and the user query
+post_cache = LRUCache(
+    max_size=int(os.getenv("POST_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("POST_CACHE_TTL", 3600))
+)
+
+# Screenshots with less extracted text than this get _FALLBACK_POST instead of an LLM call
+MIN_OCR_CHARS = int(os.getenv("MIN_OCR_CHARS", 8))
+
+_FALLBACK_POST = {
+    "title": "没有识别到文字内容",
+    "content": "这张截图里没有识别到足够的文字，暂时无法生成推文。请换一张文字更清晰的截图再试试～",
+    "hashtags": [],
+    "style": "general"
+}
+
+def _generate_post_cached(image_analysis: Dict[str, Any], user_query: str = "") -> Dict[str, Any]:
+    """
+    Generate a post, reusing a previous post for the same extracted text.
+    
+    Args:
+        image_analysis: Image analysis data
+        user_query: Optional user query; only posts generated for the same query are reused
+        
+    Returns:
+        Generated post
+    """
+    # The LLM can't write a meaningful post from (almost) no text
+    if len(image_analysis.get("text", "").strip()) < MIN_OCR_CHARS:
+        logger.warning("Extracted text is too short to generate a post, returning the fallback post")
+        return _FALLBACK_POST
+    
+    # OCR line breaks and spacing can vary between identical screenshots, so only
+    # the non-whitespace characters identify the text
+    normalized_text = "".join(image_analysis.get("text", "").split())
+    cache_key = (hashlib.sha256(normalized_text.encode("utf-8")).hexdigest(), user_query)
+    post = post_cache.get(cache_key)
+    if post is None:
+        post = post_generator.generate_post(image_analysis, user_query)
+        # Don't keep posts assembled from template fallbacks after an LLM failure
+        if not post.get("fallback"):
+            post_cache.put(cache_key, post)
+    return post
+
 # Define request/response models
 class ProcessScreenshotRequest(BaseModel):
     image_url: str = Field(..., description="URL to the image")
@@ -70,7 +297,7 @@ class ProcessAndGenerateResponse(BaseModel):
     post: PostResponse = Field(..., description="Generated post")
 
 @mcp.tool
-def process_screenshot(image_url: str) -> Dict[str, Any]:
+async def process_screenshot(image_url: str) -> Dict[str, Any]:
     """
     Process a screenshot and extract text using OCR.
     
@@ -81,37 +308,27 @@ def process_screenshot(image_url: str) -> Dict[str, Any]:
         OCR results and image analysis
     """
     try:
-        # Download the image from URL
-        logger.info(f"Downloading image from URL: {image_url}")
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Get the image bytes
-        image_bytes = response.content
-        
-        # Process the image
-        image_analysis = image_processor.process_image(image_bytes)
+        # Download and process the image
+        image_analysis = await _analyze_image_url(image_url)
         
         # Convert to response format
         response = {
             "text": image_analysis.get("text", ""),
-            "text_blocks": [
-                {"text": block.get("text", ""), "box": block.get("box", [0, 0, 0, 0])}
-                for block in image_analysis.get("text_blocks", [])
-            ],
+            # Blocks from image_processor already have exactly the text/box shape of TextBlock
+            "text_blocks": image_analysis.get("text_blocks", []),
             "analysis": image_analysis.get("analysis", {})
         }
         
         return response
-    except requests.RequestException as e:
-        logger.error(f"Error downloading image: {str(e)}")
-        raise Exception(f"Error downloading image: {str(e)}")
+    except DownloadError:
+        logger.exception("Error downloading image")
+        raise
     except Exception as e:
-        logger.error(f"Error processing screenshot: {str(e)}")
-        raise Exception(f"Error processing screenshot: {str(e)}")
+        logger.exception("Error processing screenshot")
+        raise OCRError(str(e)) from e
 
 @mcp.tool
-def generate_post(image_analysis: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_post(image_analysis: Dict[str, Any]) -> Dict[str, Any]:
     """
     Generate a trending Xiaohongshu post based on image analysis.
     
@@ -123,7 +340,7 @@ def generate_post(image_analysis: Dict[str, Any]) -> Dict[str, Any]:
     """
     try:
         # Generate the post
-        post = post_generator.generate_post(image_analysis)
+        post = await asyncio.to_thread(_generate_post_cached, image_analysis)
         
         # Convert to response format
         response = {
@@ -135,11 +352,11 @@ def generate_post(image_analysis: Dict[str, Any]) -> Dict[str, Any]:
         
         return response
     except Exception as e:
-        logger.error(f"Error generating post: {str(e)}")
-        raise Exception(f"Error generating post: {str(e)}")
+        logger.exception("Error generating post")
+        raise PostGenerationError(str(e)) from e
 
 @mcp.tool
-def process_and_generate(image_url: str, user_query: str = "") -> Dict[str, Any]:
+async def process_and_generate(image_url: str, user_query: str = "") -> Dict[str, Any]:
     """
     Process a screenshot and generate a trending Xiaohongshu post in one step.
     
@@ -151,19 +368,11 @@ def process_and_generate(image_url: str, user_query: str = "") -> Dict[str, Any]
         OCR results and generated post
     """
     try:
-        # Download the image from URL
-        logger.info(f"Downloading image from URL: {image_url}")
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Get the image bytes
-        image_bytes = response.content
-        
-        # Process the image
-        image_analysis = image_processor.process_image(image_bytes)
+        # Download and process the image
+        image_analysis = await _analyze_image_url(image_url)
         
         # Generate post with user query
-        post = post_generator.generate_post(image_analysis, user_query)
+        post = await asyncio.to_thread(_generate_post_cached, image_analysis, user_query)
         
         # Return the combined result
         # result = {
@@ -190,24 +399,46 @@ def process_and_generate(image_url: str, user_query: str = "") -> Dict[str, Any]
                 "style": post.get("style", "general")
             }
         }
-        print(result)
         return result
-    except requests.RequestException as e:
-        logger.error(f"Error downloading image: {str(e)}")
-        raise Exception(f"Error downloading image: {str(e)}")
+    except DownloadError:
+        logger.exception("Error downloading image")
+        raise
     except Exception as e:
-        logger.error(f"Error processing and generating: {str(e)}")
-        raise Exception(f"Error processing and generating: {str(e)}")
+        logger.exception("Error processing and generating")
+        raise ProcessAndGenerateError(str(e)) from e
 
 @mcp.tool
 def health_check() -> Dict[str, str]:
     """Health check endpoint."""
     return {"status": "ok"}
 
+def _warmup() -> None:
+    """Run one small OCR inference so the first request doesn't pay the model start-up cost."""
+    try:
+        logger.info("Warming up OCR models")
+        warmup()
+    except Exception:
+        # Serve anyway; the first request will just be slower
+        logger.exception("Error warming up OCR models")
+
 if __name__ == "__main__":
     # Get port from environment variable or use default
     port = int(os.getenv("PORT", 10301))
     
+    _warmup()
+    
+    # Use the faster libuv-based event loop when uvloop is installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
+    # Local clients can connect over a Unix domain socket instead of TCP
+    uvicorn_config = {}
+    if os.getenv("MCP_UDS"):
+        uvicorn_config["uds"] = os.getenv("MCP_UDS")
+    
     # Run the server
     transport = "sse" #"streamable-http"
-    mcp.run(transport=transport, host="127.0.0.1", port=port)
+    mcp.run(transport=transport, host="127.0.0.1", port=port, uvicorn_config=uvicorn_config)